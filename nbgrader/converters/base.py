@@ -119,12 +119,12 @@ class BaseConverter(LoggingConfigurable):
             found = glob.glob(assignment_glob2)
             if found:
                 # Normally it is a bad idea to put imports in the middle of
-                # a function, but we do this here because otherwise fuzzywuzzy
-                # prints an annoying message about python-Levenshtein every
-                # time nbgrader is run.
-                from fuzzywuzzy import fuzz
-                scores = sorted([(fuzz.ratio(assignment_glob, x), x) for x in found])
-                self.log.error("Did you mean: %s", scores[-1][1])
+                # a function, but we do this here so that nbgrader does not
+                # pay for importing rapidfuzz every time it is run.
+                from rapidfuzz import fuzz, process
+                best = process.extractOne(assignment_glob, found, scorer=fuzz.ratio)
+                if best:
+                    self.log.error("Did you mean: %s", best[0])
 
             raise NbGraderException(msg)
 
@@ -251,16 +251,25 @@ class BaseConverter(LoggingConfigurable):
         self.log.info("Setting destination file permissions to %s", self.permissions)
         dest = os.path.normpath(self._format_dest(assignment_id, student_id))
         permissions = int(str(self.permissions), 8)
-        for dirname, _, filenames in os.walk(dest):
+        # Where available, chmod relative to the open directory instead of
+        # resolving the full path of every file.
+        if hasattr(os, 'fwalk'):
+            walk = ((dirname, filenames, dirfd) for dirname, _, filenames, dirfd in os.fwalk(dest))
+        else:
+            walk = ((dirname, filenames, None) for dirname, _, filenames in os.walk(dest))
+        for dirname, filenames, dirfd in walk:
+            base = dirname if dirfd is None else ''
             for filename in filenames:
-                os.chmod(os.path.join(dirname, filename), permissions)
+                os.chmod(os.path.join(base, filename), permissions, dir_fd=dirfd)
             # If groupshared, set dir permissions - see comment below.
-            st_mode = os.stat(dirname).st_mode
-            if self.coursedir.groupshared and st_mode & 0o2770 != 0o2770:
-                try:
-                    os.chmod(dirname, (st_mode|0o2770) & 0o2777)
-                except PermissionError:
-                    self.log.warning("Could not update permissions of %s to make it groupshared", dirname)
+            if self.coursedir.groupshared:
+                path = dirname if dirfd is None else '.'
+                st_mode = os.stat(path, dir_fd=dirfd).st_mode
+                if st_mode & 0o2770 != 0o2770:
+                    try:
+                        os.chmod(path, (st_mode|0o2770) & 0o2777, dir_fd=dirfd)
+                    except PermissionError:
+                        self.log.warning("Could not update permissions of %s to make it groupshared", dirname)
         # If groupshared, set write permissions on directories.  Directories
         # are created within ipython_genutils.path.ensure_dir_exists via
         # nbconvert.writer, (unless there are supplementary files) with a
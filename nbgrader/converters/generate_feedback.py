@@ -1,9 +1,7 @@
-import os
-
 from traitlets.config import Config
 from traitlets import List, default
 #from nbconvert.exporters import HTMLExporter
-from ..exporters import FormExporter
+from ..exporters import FormExporter, TEMPLATE_PATH
 from nbconvert.preprocessors import CSSHTMLHeaderPreprocessor
 
 from .base import BaseConverter
@@ -58,6 +56,5 @@ class GenerateFeedback(BaseConverter):
         c = Config()
         c.FormExporter.template_file = 'feedback.tpl'
         if 'template_path' not in self.config.FormExporter:
-            template_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'server_extensions', 'formgrader', 'templates'))
-            c.FormExporter.template_path = ['.', template_path]
+            c.FormExporter.template_path = ['.', TEMPLATE_PATH]
         self.update_config(c)
@@ -1,11 +1,15 @@
 import os
 import glob
+import hashlib
 import re
 import shutil
 import sys
 import six
+import nbconvert
+import nbgrader
 import nbgrader.apps
 
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import dedent
 from clear_docs import run, clear_notebooks
 
@@ -97,14 +101,60 @@ def autogen_config(root):
         f.write(config)
 
 
+def _hash_tree(h, top, skip=()):
+    """Update the hash h with the relative paths and contents of the files
+    below top, leaving out the directories named in skip."""
+    skip = set(skip) | {'__pycache__', '.ipynb_checkpoints'}
+    for dirpath, dirnames, filenames in os.walk(top):
+        dirnames[:] = sorted(d for d in dirnames if d not in skip)
+        for filename in sorted(filenames):
+            if filename.endswith('.pyc'):
+                continue
+            pth = os.path.join(dirpath, filename)
+            h.update(os.path.relpath(pth, top).encode('utf-8'))
+            with open(pth, 'rb') as fh:
+                h.update(hashlib.sha256(fh.read()).digest())
+
+
+def docs_cache_key(root):
+    """Hash everything that the execution of the user guide depends on: the
+    (cleared) contents of the user guide, the sources of nbgrader and the
+    nbconvert version."""
+    h = hashlib.sha256()
+    h.update(nbconvert.__version__.encode('utf-8'))
+    # the version of nbgrader does not change during development
+    _hash_tree(h, os.path.dirname(os.path.abspath(nbgrader.__file__)),
+               skip=('docs', 'tests'))
+    _hash_tree(h, os.path.join(root, 'user_guide'))
+    return h.hexdigest()
+
+
+def docs_cache_dir():
+    return os.environ.get(
+        'NBGRADER_DOCS_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'nbgrader-docs'))
+
+
 def execute_notebooks(root):
     """Execute notebooks"""
     print("Executing notebooks in '{}'...".format(os.path.abspath(root)))
 
+    # the notebooks share the course directory and their outputs depend on
+    # each other, so the executed user guide is cached as a whole
+    user_guide = os.path.join(root, 'user_guide')
+    cache_dir = docs_cache_dir()
+    cached = os.path.join(cache_dir, docs_cache_key(root))
+    if os.path.isdir(cached):
+        print("Restoring executed notebooks from '{}'".format(cached))
+        shutil.rmtree(user_guide)
+        shutil.copytree(cached, user_guide)
+        return
+
     cwd = os.getcwd()
     os.chdir(root)
 
-    # hack to convert links to ipynb files to html
+    # the notebooks run nbgrader on the same course directory and exchange,
+    # one after the other, so they must not be executed in parallel
     for filename in sorted(glob.glob('user_guide/*.ipynb')):
         run([
             sys.executable, '-m', 'jupyter', 'nbconvert',
@@ -116,6 +166,31 @@ def execute_notebooks(root):
 
     os.chdir(cwd)
 
+    # copy next to the cache entry and rename it into place, so that an
+    # interrupted copy is never taken for a complete build
+    tmp = cached + '.tmp'
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    shutil.copytree(
+        user_guide, tmp,
+        ignore=shutil.ignore_patterns('__pycache__', '.ipynb_checkpoints'))
+    os.rename(tmp, cached)
+
+    # only keep the most recent build around; the cache directory may be
+    # shared with other files, so only remove the builds stored here
+    for name in os.listdir(cache_dir):
+        if name == os.path.basename(cached):
+            continue
+        if re.match(r'^[0-9a-f]{64}(\.tmp)?$', name):
+            shutil.rmtree(os.path.join(cache_dir, name))
+
+
+def run_all(cmds):
+    """Run the independent commands cmds concurrently, each in its own process."""
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+        for future in [pool.submit(run, cmd) for cmd in cmds]:
+            future.result()
+
 
 def convert_notebooks(root):
     """Convert notebooks to rst and html"""
@@ -124,15 +199,21 @@ def convert_notebooks(root):
     cwd = os.getcwd()
     os.chdir(root)
 
-    # hack to convert links to ipynb files to html
-    for filename in sorted(glob.glob('user_guide/*.ipynb')):
-        run([
+    # the conversions do not depend on each other, so they are run in
+    # parallel; unlike the execution of the user guide, see above
+    filenames = sorted(glob.glob('user_guide/*.ipynb'))
+    run_all([
+        [
             sys.executable, '-m', 'jupyter', 'nbconvert',
             '--to', 'rst',
             '--FilesWriter.build_directory=user_guide',
             filename
-        ])
+        ]
+        for filename in filenames
+    ])
 
+    # hack to convert links to ipynb files to html
+    for filename in filenames:
         filename = os.path.splitext(filename)[0] + '.rst'
         with open(filename, 'r') as fh:
             source = fh.read()
@@ -141,6 +222,7 @@ def convert_notebooks(root):
             fh.write(source)
 
     # convert examples to html
+    html_cmds = []
     for dirname, dirnames, filenames in os.walk('user_guide'):
         if dirname == 'user_guide':
             continue
@@ -155,7 +237,7 @@ def convert_notebooks(root):
 
         for filename in sorted(filenames):
             if filename.endswith('.ipynb'):
-                run([
+                html_cmds.append([
                     sys.executable, '-m', 'jupyter', 'nbconvert',
                     '--to', 'html',
                     "--FilesWriter.build_directory='{}'".format(build_directory),
@@ -168,6 +250,7 @@ def convert_notebooks(root):
                 if os.path.exists(dest):
                     os.remove(dest)
                 shutil.copy(src, dest)
+    run_all(html_cmds)
 
     os.chdir(cwd)
 
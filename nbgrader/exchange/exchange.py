@@ -1,23 +1,33 @@
 import os
 import datetime
+import errno
 import sys
 import shutil
 import glob
+import json
+import tempfile
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from textwrap import dedent
 
 from dateutil.tz import gettz
 from traitlets.config import LoggingConfigurable
-from traitlets import Unicode, Bool, Instance, Type, default, validate
+from traitlets import Unicode, Bool, Integer, Instance, Type, default, validate
 from jupyter_core.paths import jupyter_data_dir
 
-from ..utils import check_directory, ignore_patterns, self_owned
+from ..utils import (
+    check_directory, ignore_patterns, compile_globs, self_owned, get_username,
+    notebook_hash)
 from ..coursedir import CourseDirectory
 from ..auth import Authenticator
 
 from dateutil import tz
 from stat import (S_IRUSR, S_IWUSR, S_IXUSR, S_IRGRP, S_IWGRP, S_IXGRP, S_IROTH, S_IWOTH, S_IXOTH)
 
+# files at least this large are copied with os.copy_file_range, when available
+COPY_FILE_RANGE_MIN_SIZE = 64 * 1024
+
+
 class ExchangeError(Exception):
     pass
 
@@ -70,6 +80,14 @@ class Exchange(LoggingConfigurable):
         )
     ).tag(config=True)
 
+    copy_workers = Integer(
+        help="Number of threads used to copy files in and out of the exchange."
+    ).tag(config=True)
+
+    @default("copy_workers")
+    def _copy_workers_default(self):
+        return min(32, (os.cpu_count() or 1) * 4)
+
     coursedir = Instance(CourseDirectory, allow_none=True)
     authenticator = Instance(Authenticator, allow_none=True)
 
@@ -77,11 +95,28 @@ class Exchange(LoggingConfigurable):
         self.coursedir = coursedir
         self.authenticator = authenticator
         super(Exchange, self).__init__(**kwargs)
+        # looked up once; the exchange steps need them several times per run
+        self._jh_user = os.getenv('JUPYTERHUB_USER')
+        try:
+            self._username = get_username()
+        except OSError:
+            # no pwd module (Windows)
+            self._username = None
         self.owx_perms = (S_IRUSR|S_IWUSR|S_IXUSR|S_IRGRP|S_IWGRP|S_IXGRP|S_IWOTH|S_IXOTH)
         self.ow_perms = (S_IRUSR|S_IWUSR|S_IXUSR|S_IRGRP|S_IWGRP|S_IXGRP|S_IWOTH)
         self.orx_perms = (S_IRUSR|S_IWUSR|S_IXUSR|S_IRGRP|S_IWGRP|S_IXGRP|S_IROTH|S_IXOTH)
         self.orwx_perms = (S_IRUSR|S_IWUSR|S_IXUSR|S_IRGRP|S_IWGRP|S_IXGRP|S_IROTH|S_IWOTH|S_IXOTH)
 
+    _ignore_re = None
+
+    def _ignore(self, directory, names):
+        """Ignore callback for :func:`shutil.copytree` excluding the
+        coursedir.ignore globs, which are only compiled once."""
+        if self._ignore_re is None:
+            self._ignore_re = compile_globs(self.coursedir.ignore)
+        match = self._ignore_re.match
+        return {name for name in names if match(os.path.normcase(name))}
+
     def fail(self, msg):
         self.log.fatal(msg)
         raise ExchangeError(msg)
@@ -93,16 +128,95 @@ class Exchange(LoggingConfigurable):
         if tz is None:
             self.fail("Invalid timezone: {}".format(self.timezone))
         self.timestamp = datetime.datetime.now(tz_local).strftime(self.timestamp_format)
+        self._timestamp_bytes = self.timestamp.encode('utf-8')
 
-    def set_perms(self, dest, fileperms, dirperms):
-        all_dirs = []
-        for dirname, _, filenames in os.walk(dest):
-            for filename in filenames:
-                os.chmod(os.path.join(dirname, filename), fileperms)
-            all_dirs.append(dirname)
+    def _write_timestamp(self, path):
+        """Write the timestamp to the file path."""
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, self._timestamp_bytes)
+        finally:
+            os.close(fd)
+
+    _checksums = None
+    _checksums_dirty = False
+
+    @property
+    def _checksums_file(self):
+        return os.path.join(self.cache, 'checksums.json')
+
+    def _notebook_hash(self, path, unique_key=None):
+        """:func:`notebook_hash` of the notebook at path, memoized in the
+        cache directory as long as its mtime and size do not change."""
+        if self._checksums is None:
+            try:
+                with open(self._checksums_file, 'r') as fh:
+                    self._checksums = json.load(fh)
+            except (OSError, ValueError):
+                self._checksums = {}
+        st = os.stat(path)
+        path = os.path.abspath(path)
+        entry = self._checksums.get(path)
+        if entry is None or entry['mtime_ns'] != st.st_mtime_ns or entry['size'] != st.st_size:
+            entry = self._checksums[path] = {
+                'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'hashes': {}}
+        key = unique_key or ''
+        if key not in entry['hashes']:
+            entry['hashes'][key] = notebook_hash(path, unique_key)
+            self._checksums_dirty = True
+        return entry['hashes'][key]
+
+    def _save_checksums(self):
+        """Write the hashes computed by _notebook_hash back to the cache,
+        forgetting the notebooks that no longer exist."""
+        if self._checksums is None or not os.path.isdir(self.cache):
+            return
+        for path in [p for p in self._checksums if not os.path.exists(p)]:
+            del self._checksums[path]
+            self._checksums_dirty = True
+        if not self._checksums_dirty:
+            return
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.cache, prefix='.checksums')
+        except OSError as e:
+            self.log.debug("Could not save notebook checksums: %s", e)
+            return
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(self._checksums, fh)
+            # atomic, so that concurrent runs never see a partial file
+            os.replace(tmp, self._checksums_file)
+        except OSError as e:
+            self.log.debug("Could not save notebook checksums: %s", e)
+            os.remove(tmp)
+        else:
+            self._checksums_dirty = False
+
+    def _batch_chmod(self, paths_modes, on_error=None, dir_fd=None):
+        """Apply a sequence of ``(path, mode)`` pairs, paths being relative
+        to dir_fd if given. If on_error is given, it is called with the path
+        of every chmod failing with a PermissionError instead of raising."""
+        chmod = os.chmod
+        kwargs = {'dir_fd': dir_fd}
+        if chmod in os.supports_follow_symlinks:
+            # do not touch the targets of symlinks (not supported on Linux)
+            kwargs['follow_symlinks'] = False
+        for path, mode in paths_modes:
+            try:
+                chmod(path, mode, **kwargs)
+            except PermissionError:
+                if on_error is None:
+                    raise
+                on_error(path)
 
-        for dirname in all_dirs[::-1]:
-            os.chmod(dirname, dirperms)
+    def set_perms(self, dest, fileperms, dirperms):
+        # walk bottom-up, so that directories are updated after their
+        # contents, and chmod relative to the open directory
+        for _, dirnames, filenames, dirfd in os.fwalk(dest, topdown=False):
+            paths_modes = [(filename, fileperms) for filename in filenames]
+            paths_modes.extend((dirname, dirperms) for dirname in dirnames)
+            self._batch_chmod(paths_modes, dir_fd=dirfd)
+        os.chmod(dest, dirperms)
 
     def ensure_root(self):
         """See if the exchange directory exists and is writable, fail if not."""
@@ -121,45 +235,141 @@ class Exchange(LoggingConfigurable):
         """Actually do the file transfer."""
         raise NotImplementedError
 
+    def _walk_copy_tree(self, src, dest, ignore=None):
+        """Recursively yield ``(entry, dest)`` for every :class:`os.DirEntry`
+        of the src dir that is not ignored, parent directories before their
+        contents."""
+        with os.scandir(src) as it:
+            entries = list(it)
+        ignored = set(ignore(src, [entry.name for entry in entries])) if ignore else set()
+        for entry in entries:
+            if entry.name in ignored:
+                continue
+            dest_name = os.path.join(dest, entry.name)
+            yield entry, dest_name
+            if entry.is_dir():
+                for item in self._walk_copy_tree(entry.path, dest_name, ignore):
+                    yield item
+
+    def _groupshared_modes(self, paths_modes, perms, mask):
+        """Yield ``(path, mode)`` for each path whose current mode lacks the
+        perms bits."""
+        for path, st_mode in paths_modes:
+            if st_mode & perms != perms:
+                yield path, (st_mode|perms) & mask
+
+    def _groupshared_error(self, path):
+        self.log.warning("Could not update permissions of %s to make it groupshared", path)
+
+    def _copy_file_data(self, src, dest, size):
+        """Copy the content of src to dest. Large files are copied with
+        copy_file_range, which stays in the kernel and lets copy-on-write
+        filesystems share the data blocks instead of duplicating them."""
+        if size < COPY_FILE_RANGE_MIN_SIZE or not hasattr(os, 'copy_file_range'):
+            shutil.copyfile(src, dest)
+            return
+
+        with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+            copied = 0
+            try:
+                while True:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), 2**30)
+                    if not n:
+                        break
+                    copied += n
+            except OSError as e:
+                # e.g. unsupported by the filesystem or across filesystems
+                # on older kernels
+                if e.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+            else:
+                # some filesystems (e.g. procfs or network filesystems)
+                # return 0 without copying anything, so 0 only means EOF
+                # once the whole file has been copied
+                if copied >= size:
+                    return
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst)
+
+    def _copy_file(self, src, st, dest):
+        self._copy_file_data(src, dest, st.st_size)
+        shutil.copystat(src, dest)
+        # copystat copies access mode too - so we must add go+rw back to it if
+        # we are in groupshared. The mode of dest is now the one of the
+        # source file, which we already know about.
+        if self.coursedir.groupshared:
+            self._batch_chmod(
+                self._groupshared_modes([(dest, st.st_mode)], 0o660, 0o777),
+                on_error=self._groupshared_error)
+
+    def _copy_ignore(self):
+        return ignore_patterns(exclude=self.coursedir.ignore,
+                               include=self.coursedir.include,
+                               max_file_size=self.coursedir.max_file_size,
+                               log=self.log)
+
+    def do_copy_file(self, src, dest):
+        """
+        Copy the file src to dest, unless do_copy would omit it when
+        copying its directory. Returns whether the file was copied.
+        """
+        directory, name = os.path.split(src)
+        if name in self._copy_ignore()(directory, [name]):
+            return False
+        try:
+            self._copy_file(src, os.stat(src), dest)
+        except (shutil.Error, OSError) as e:
+            self.log.error("Error copying {}: {}".format(src, e))
+            return False
+        return True
+
     def do_copy(self, src, dest, log=None):
         """
         Copy the src dir to the dest dir, omitting excluded
         file/directories, non included files, and too large files, as
         specified by the options coursedir.ignore, coursedir.include
         and coursedir.max_file_size.
+
+        The directory tree is created first, then the files are copied
+        concurrently by a pool of `copy_workers` threads.
         """
+        ignore = self._copy_ignore()
         try:
-            shutil.copytree(src, dest,
-                        ignore=ignore_patterns(exclude=self.coursedir.ignore,
-                                               include=self.coursedir.include,
-                                               max_file_size=self.coursedir.max_file_size,
-                                               log=self.log))
+            os.makedirs(dest)
+            dirs = [(src, dest)]
+            files = []
+            for entry, dest_name in self._walk_copy_tree(src, dest, ignore):
+                if entry.is_dir():
+                    os.mkdir(dest_name)
+                    dirs.append((entry.path, dest_name))
+                else:
+                    files.append((entry, dest_name))
+
+            with ThreadPoolExecutor(max_workers=self.copy_workers) as executor:
+                futures = [executor.submit(self._copy_file, entry.path, entry.stat(), dest_name)
+                           for entry, dest_name in files]
+                for future in as_completed(futures):
+                    future.result()
+
+            # copy the directory metadata last, so that read-only
+            # directories do not prevent copying their contents
+            for src_name, dest_name in reversed(dirs):
+                shutil.copystat(src_name, dest_name)
         except (shutil.Error, OSError) as e:
-            self.log.error("Error copying: ".format(src))
+            self.log.error("Error copying {}: {}".format(src, e))
             return False
 
-        # copytree copies access mode too - so we must add go+rw back to it if
-        # we are in groupshared.
+        # dirs become ug+rwx if we are in groupshared
         if self.coursedir.groupshared:
-            for dirname, _, filenames in os.walk(dest):
-                # dirs become ug+rwx
-                st_mode = os.stat(dirname).st_mode
-                if st_mode & 0o2770 != 0o2770:
-                    try:
-                        os.chmod(dirname, (st_mode|0o2770) & 0o2777)
-                    except PermissionError:
-                        self.log.warning("Could not update permissions of %s to make it groupshared", dirname)
-
-                for filename in filenames:
-                    filename = os.path.join(dirname, filename)
-                    st_mode = os.stat(filename).st_mode
-                    if st_mode & 0o660 != 0o660:
-                        try:
-                            os.chmod(filename, (st_mode|0o660) & 0o777)
-                        except PermissionError:
-                            self.log.warning("Could not update permissions of %s to make it groupshared", filename)
-        return True      
-  
+            self._batch_chmod(
+                self._groupshared_modes(
+                    [(dest_name, os.stat(dest_name).st_mode) for _, dest_name in dirs],
+                    0o2770, 0o2777),
+                on_error=self._groupshared_error)
+        return True
+
     def start(self):
         if sys.platform == 'win32':
             self.fail("Sorry, the exchange is not available on Windows.")
@@ -181,12 +391,12 @@ class Exchange(LoggingConfigurable):
         found = glob.glob(other_path)
         if found:
             # Normally it is a bad idea to put imports in the middle of
-            # a function, but we do this here because otherwise fuzzywuzzy
-            # prints an annoying message about python-Levenshtein every
-            # time nbgrader is run.
-            from fuzzywuzzy import fuzz
-            scores = sorted([(fuzz.ratio(self.src_path, x), x) for x in found])
-            self.log.error("Did you mean: %s", scores[-1][1])
+            # a function, but we do this here so that nbgrader does not
+            # pay for importing rapidfuzz every time it is run.
+            from rapidfuzz import fuzz, process
+            best = process.extractOne(self.src_path, found, scorer=fuzz.ratio)
+            if best:
+                self.log.error("Did you mean: %s", best[0])
 
         raise ExchangeError(msg)
 
@@ -1,15 +1,20 @@
 import os
 import shutil
-import glob
+import hashlib
 import copy
-import nbformat
+import random
 
 from traitlets import Bool
 
 from .exchange import Exchange
-from ..utils import check_mode
+from ..utils import check_mode, read_notebook, write_notebook
 from ..preprocessors import Scramble, PermuteTasks
 
+# the marker of scrambled notebooks, and how much of each fetched notebook
+# is searched for it before the rest of the file
+SCRAMBLE_MARKER = b'"%% scramble'
+SCRAMBLE_SCREEN_SIZE = 64 * 1024
+
 
 class ExchangeFetchAssignment(Exchange):
 
@@ -81,23 +86,60 @@ class ExchangeFetchAssignment(Exchange):
     def do_copy(self, src, dest):
         """Copy the src dir to the dest dir omitting the self.coursedir.ignore globs."""
         if os.path.isdir(self.dest_path):
-            self.copy_if_missing(src, dest, ignore=shutil.ignore_patterns(*self.coursedir.ignore))
+            self.copy_if_missing(src, dest, ignore=self._ignore)
         else:
-            shutil.copytree(src, dest, ignore=shutil.ignore_patterns(*self.coursedir.ignore))
+            shutil.copytree(src, dest, ignore=self._ignore)
+
+    def scramble_seed(self, student_id):
+        """Seed of the scrambling for student_id, stable across runs unlike
+        the builtin (randomized) hash of the string."""
+        digest = hashlib.sha256(str(student_id).encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'little')
+
+    def _scramble_candidates(self, dest):
+        """Paths of the notebooks in dest which may need to be scrambled,
+        screened on their raw bytes so that the others are never parsed."""
+        candidates = []
+        with os.scandir(dest) as it:
+            for entry in it:
+                if not entry.name.endswith('.ipynb') or not entry.is_file():
+                    continue
+                # the source of the first cell is usually within the head,
+                # but the keys of a cell are sorted, so large attachments
+                # come before it; then the rest of the file is searched too
+                with open(entry.path, 'rb') as f:
+                    head = f.read(SCRAMBLE_SCREEN_SIZE)
+                    if SCRAMBLE_MARKER in head:
+                        candidates.append(entry.path)
+                        continue
+                    rest = f.read()
+                    if SCRAMBLE_MARKER in head[-len(SCRAMBLE_MARKER):] + rest:
+                        candidates.append(entry.path)
+        return sorted(candidates)
 
     def do_scrambling(self, dest, student_id):
+        nbs = self._scramble_candidates(dest)
+        if not nbs:
+            self.log.debug("No notebook to scramble")
+            return
         self.log.info("Scrambling for {}".format(student_id))
-        nbs = glob.glob(dest + '/*.ipynb')
         self.log.info("Found the following notebooks: {}".format(nbs))
-        scrambler = Scramble(seed=hash(student_id))
-        permuter = PermuteTasks(seed=hash(student_id))
+        if student_id is None:
+            self.log.warning(
+                "No student id to derive the scrambling from, the notebooks "
+                "are scrambled with a random seed")
+            seed = random.getrandbits(64)
+        else:
+            seed = self.scramble_seed(student_id)
+        scrambler = Scramble(seed=seed)
+        permuter = PermuteTasks(seed=seed)
         for nb_path in nbs:
-            nb = nbformat.read(nb_path, as_version=4)
+            nb = read_notebook(nb_path)
             if len(nb.cells) > 0 and nb.cells[0].source.startswith('%% scramble'):
                 resources = {}
                 nb, resources = scrambler.preprocess(nb, resources)
                 nb, resources = permuter.preprocess(nb, resources)
-            nbformat.write(nb, nb_path)
+                write_notebook(nb, nb_path)
         self.log.info("Scrambled")
 
     def copy_files(self):
@@ -106,5 +148,5 @@ class ExchangeFetchAssignment(Exchange):
         self.log.info("Source: {}".format(self.src_path))
         self.log.info("Destination: {}".format(self.dest_path))
         self.do_copy(self.src_path, self.dest_path)
-        self.do_scrambling(self.dest_path, os.getenv('JUPYTERHUB_USER'))
+        self.do_scrambling(self.dest_path, self._jh_user or self._username)
         self.log.info("Fetched as: {} {}".format(self.coursedir.course_id, self.coursedir.assignment_id))
\ No newline at end of file
@@ -3,7 +3,7 @@ import shutil
 import glob
 
 from .exchange import Exchange
-from ..utils import check_mode, notebook_hash, make_unique_key, get_username
+from ..utils import check_mode, make_unique_key
 
 
 class ExchangeFetchFeedback(Exchange):
@@ -23,7 +23,7 @@ class ExchangeFetchFeedback(Exchange):
                 self.fail("The student ID should contain no '*' nor '+'; got {}".format(self.coursedir.student_id))
             student_id = self.coursedir.student_id
         else:
-            student_id = get_username()
+            student_id = self._username
 
         if not os.path.isdir(self.src_path):
             self._assignment_not_found(
@@ -57,7 +57,7 @@ class ExchangeFetchFeedback(Exchange):
 
                 # Look for the feedback using new-style of feedback
                 self.log.debug("Unique key is: {}".format(unique_key))
-                nb_hash = notebook_hash(notebook, unique_key)
+                nb_hash = self._notebook_hash(notebook, unique_key)
                 feedbackpath = os.path.join(self.outbound_path, '{0}.html'.format(nb_hash))
                 if os.path.exists(feedbackpath):
                     self.feedback_files.append((notebook_id, timestamp, feedbackpath))
@@ -67,7 +67,7 @@ class ExchangeFetchFeedback(Exchange):
                     continue
 
                 # If it doesn't exist, try the legacy hashing
-                nb_hash = notebook_hash(notebook)
+                nb_hash = self._notebook_hash(notebook)
                 feedbackpath = os.path.join(self.outbound_path, '{0}.html'.format(nb_hash))
                 if os.path.exists(feedbackpath):
                     self.feedback_files.append((notebook_id, timestamp, feedbackpath))
@@ -80,6 +80,7 @@ class ExchangeFetchFeedback(Exchange):
                 self.log.warning(
                     "Could not find feedback for '{}/{}/{}' submitted at {}".format(
                         self.coursedir.course_id, assignment_id, notebook_id, timestamp))
+        self._save_checksums()
 
     def init_dest(self):
         if self.path_includes_course:
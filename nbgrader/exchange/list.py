@@ -4,7 +4,7 @@ import shutil
 import re
 import hashlib
 from traitlets import Bool
-from ..utils import notebook_hash, make_unique_key
+from ..utils import make_unique_key
 from .exchange import Exchange
 
 
@@ -138,13 +138,13 @@ class ExchangeList(Exchange):
                     info['student_id'],
                     info['timestamp'])
                 self.log.debug("Unique key is: {}".format(unique_key))
-                nb_hash = notebook_hash(notebook, unique_key)
+                nb_hash = self._notebook_hash(notebook, unique_key)
                 exchange_feedback_path = os.path.join(
                     self.root, info['course_id'], 'feedback', '{0}.html'.format(nb_hash))
                 has_exchange_feedback = os.path.isfile(exchange_feedback_path)
                 if not has_exchange_feedback:
                     # Try looking for legacy feedback.
-                    nb_hash = notebook_hash(notebook)
+                    nb_hash = self._notebook_hash(notebook)
                     exchange_feedback_path = os.path.join(
                         self.root, info['course_id'], 'feedback', '{0}.html'.format(nb_hash))
                     has_exchange_feedback = os.path.isfile(exchange_feedback_path)
@@ -181,6 +181,7 @@ class ExchangeList(Exchange):
                     info['local_feedback_path'] = None
 
             assignments.append(info)
+        self._save_checksums()
 
         # partition the assignments into groups for course/student/assignment
         if self.inbound or self.cached:
@@ -1,21 +1,24 @@
 import base64
+import copy
+import errno
+import hashlib
+import logging
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from stat import (
     S_IRUSR, S_IWUSR, S_IXUSR,
-    S_IRGRP, S_IWGRP, S_IXGRP,
-    S_IROTH, S_IWOTH, S_IXOTH
+    S_IRGRP, S_IXGRP,
+    S_IROTH
 )
 
 from textwrap import dedent
 from traitlets import Bool
 
 from .exchange import Exchange
-from ..utils import get_username, check_mode, find_all_notebooks, compute_hashcode
-
-import nbformat as nbf
-import json
-import numpy as np
-import distutils
+from ..utils import (
+    check_mode, find_all_notebooks,
+    read_notebook, write_notebook)
 
 class ExchangeSubmit(Exchange):
 
@@ -34,6 +37,15 @@ class ExchangeSubmit(Exchange):
         )
     ).tag(config=True)
 
+    cache_use_hardlinks = Bool(
+        True,
+        help=dedent(
+            "Whether to hard link the submitted files into the local cache "
+            "instead of copying them a second time. Files are still copied "
+            "if the cache and the exchange are on different filesystems."
+        )
+    ).tag(config=True)
+
     def init_src(self):
         if self.path_includes_course:
             root = os.path.join(self.coursedir.course_id, self.coursedir.assignment_id)
@@ -65,7 +77,7 @@ class ExchangeSubmit(Exchange):
                 self.fail("The student ID should contain no '*' nor '+'; got {}".format(self.coursedir.student_id))
             student_id = self.coursedir.student_id
         else:
-            student_id = get_username()
+            student_id = self._username
         if self.add_random_string:
             random_str = base64.urlsafe_b64encode(os.urandom(9)).decode('ascii')
             self.assignment_filename = '{}+{}+{}+{}'.format(
@@ -90,27 +102,19 @@ class ExchangeSubmit(Exchange):
         released_notebooks = find_all_notebooks(self.release_path)
         submitted_notebooks = find_all_notebooks(self.src_path)
 
-        # Look for missing notebooks in submitted notebooks
-        missing = False
-        release_diff = list()
-        for filename in released_notebooks:
-            if filename in submitted_notebooks:
-                release_diff.append("{}: {}".format(filename, 'FOUND'))
-            else:
-                missing = True
-                release_diff.append("{}: {}".format(filename, 'MISSING'))
-
-        # Look for extra notebooks in submitted notebooks
-        extra = False
-        submitted_diff = list()
-        for filename in submitted_notebooks:
-            if filename in released_notebooks:
-                submitted_diff.append("{}: {}".format(filename, 'OK'))
-            else:
-                extra = True
-                submitted_diff.append("{}: {}".format(filename, 'EXTRA'))
+        # Look for missing and extra notebooks in submitted notebooks
+        released = frozenset(released_notebooks)
+        submitted = frozenset(submitted_notebooks)
+        missing = not released <= submitted
+        extra = not submitted <= released
 
         if missing or extra:
+            release_diff = [
+                "{}: {}".format(filename, 'FOUND' if filename in submitted else 'MISSING')
+                for filename in released_notebooks]
+            submitted_diff = [
+                "{}: {}".format(filename, 'OK' if filename in released else 'EXTRA')
+                for filename in submitted_notebooks]
             diff_msg = (
                 "Expected:\n\t{}\nSubmitted:\n\t{}".format(
                     '\n\t'.join(release_diff),
@@ -130,68 +134,116 @@ class ExchangeSubmit(Exchange):
                     "".format(self.coursedir.assignment_id, diff_msg)
                 )
 
-    def add_text_to_cell(self, notebook_file, text, cell_id="hashcode_cell", msg="Ihr Hashcode"):
-        nb = nbf.v4.new_notebook()
-        nbr = nbf.read(notebook_file, as_version=4)
-        hash_str = str(text)
+    def _load_nb(self, notebook_file):
+        return read_notebook(notebook_file)
 
-        cell_content = """<div class=\"alert alert-block alert-danger\"> \n\n{}: </br><h1>{}</h1> \n\n</div>\n\n
-                   """.format(msg, hash_str)
-         
-        # check whether the hashcode has been generated before
-        meta_found = False
-        meta_src_idx = None
-        cell_markdown_id = cell_id
-        for i,c in enumerate(nbr['cells']):
-            curr_cel = c
-            if curr_cel['cell_type'] == "markdown":
-                metadata = curr_cel['metadata']
-                source = curr_cel['source']
-                if 'name' in metadata:
-                    for meta in metadata:
-                        metadata_nbgrader = metadata['name']
-                        if metadata_nbgrader == cell_markdown_id:
-                            meta_found = True
-                            meta_src_idx = i
-
-        # if meta found in nb already, then append
-        # otherwise append new cell for hashcode
-        if meta_found:
-            nbr['cells'][meta_src_idx]['source'] = cell_content
-        else:    
-            addition = nbf.v4.new_markdown_cell(cell_content)
-            addition['metadata']["name"] = cell_markdown_id
-            addition['metadata']["deletable"] = False
-            addition['metadata']["editable"] = False
-            nbr['cells'].append(addition)
+    def _save_nb(self, nb, notebook_file, validate=False):
+        return write_notebook(nb, notebook_file, validate=validate)
 
-        # Write the updated notebook with hashcode
-        f = None
-        try:
-            f = open(notebook_file, 'w')
-            nbf.write(nbr, f)
-        finally:
-            if f is not None:
-                f.close()
+    def add_text_to_cell(self, nb, text, cell_id="hashcode_cell", msg="Ihr Hashcode"):
+        """Display text in the read-only markdown cell named cell_id of the
+        notebook nb, appending the cell if the notebook does not have it yet."""
+        import nbformat as nbf
 
-    def generate_html(self, hashcoded_notebook_file, html_file):
+        cell_content = """<div class=\"alert alert-block alert-danger\"> \n\n{}: </br><h1>{}</h1> \n\n</div>\n\n
+                   """.format(msg, str(text))
+
+        # check whether the cell has been generated before; it is normally
+        # the last one, so search from the end
+        for cell in reversed(nb.cells):
+            if cell.cell_type == "markdown" and cell.metadata.get('name') == cell_id:
+                cell.source = cell_content
+                break
+        else:
+            addition = nbf.v4.new_markdown_cell(cell_content)
+            addition.metadata["name"] = cell_id
+            addition.metadata["deletable"] = False
+            addition.metadata["editable"] = False
+            nb.cells.append(addition)
+        return nb
+
+    _html_exporter = None
+    _html_exporter_config = None
+
+    def generate_html(self, nb, hashcoded_notebook_file, html_file):
+        """Convert the in-memory notebook nb, saved as
+        hashcoded_notebook_file, to html_file."""
         self.log.info("Converting to html using nbconvert")
-        os.system('jupyter nbconvert --to nbgrader.exporters.FormExporter --template=form {} {}'.format(hashcoded_notebook_file, html_file))
-
-    def copy_and_overwrite_dir(self, src, dest):
+        resources = {'metadata': {
+            'name': os.path.splitext(os.path.basename(hashcoded_notebook_file))[0],
+            'path': os.path.dirname(hashcoded_notebook_file)}}
+        # the exporter is created once per process and shared by all the
+        # submissions with the same config (e.g. of the assignment list
+        # server extension), so that its templates are only loaded and
+        # compiled for the first one
+        try:
+            if self._html_exporter is None or self._html_exporter_config != self.config:
+                # imported here, as it pulls in bs4 and the nbconvert
+                # exporters, which only exam submissions need
+                from ..exporters import FormExporter
+                type(self)._html_exporter = FormExporter(
+                    config=self.config, template_file='form')
+                type(self)._html_exporter_config = copy.deepcopy(self.config)
+            body, _ = self._html_exporter.from_notebook_node(nb, resources=resources)
+        except Exception as e:
+            # like a failing nbconvert call, this must not keep the
+            # assignment from being submitted
+            self.log.error("Failed to convert {} to html: {}".format(
+                hashcoded_notebook_file, e))
+            return
+        with open(html_file, 'w') as fh:
+            fh.write(body)
+
+    def _save_hashcoded(self, nb, hashcoded_notebook_file, html_file):
+        """Save the hashcoded notebook nb, then convert it to html_file."""
+        self._save_nb(nb, hashcoded_notebook_file)
+        self.generate_html(nb, hashcoded_notebook_file, html_file)
+
+    def copy_and_overwrite_dir(self, src, dest, skip=()):
+        """Copy src into dest, overwriting existing files, except for the
+        ignored globs and the files directly in src named in skip."""
         if not os.path.exists(src):
-            self.log.info("Source does not exists: ", src)
+            self.log.info("Source does not exists: {}".format(src))
             return False
-        distutils.dir_util.copy_tree(src, dest)
-        return True    
-    
+        ignore_globs = shutil.ignore_patterns(*self.coursedir.ignore, '.temp')
+
+        def ignore(directory, names):
+            ignored = ignore_globs(directory, names)
+            if directory == src:
+                ignored.update(name for name in skip if name in names)
+            return ignored
+
+        shutil.copytree(src, dest, dirs_exist_ok=True, ignore=ignore)
+        return True
+
     def copy_and_overwrite_file(self, src, dest):
         if not os.path.exists(src):
-            self.log.info("Source does not exists: ", src)
+            self.log.info("Source does not exists: {}".format(src))
             return False
-        distutils.file_util.copy_file(src, dest)
-        return True    
-    
+        shutil.copyfile(src, dest)
+        return True
+
+    def _link_tree(self, src, dest):
+        """Mirror the src dir into the dest dir, hard linking the files
+        rather than copying them whenever possible."""
+        try:
+            os.makedirs(dest)
+            for entry, dest_name in self._walk_copy_tree(src, dest):
+                if entry.is_dir():
+                    os.mkdir(dest_name)
+                    continue
+                try:
+                    os.link(entry.path, dest_name)
+                except OSError as e:
+                    # e.g. src and dest are on different filesystems
+                    if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                        raise
+                    shutil.copy2(entry.path, dest_name)
+        except (shutil.Error, OSError) as e:
+            self.log.error("Error linking {}: {}".format(src, e))
+            return False
+        return True
+
     def copy_files(self):
         self.init_release()
 
@@ -200,15 +252,24 @@ class ExchangeSubmit(Exchange):
         #check notebook exists
         if os.path.isfile(student_notebook_file):
             # Add time stamp to original notebook
-            self.add_text_to_cell(student_notebook_file, self.timestamp, cell_id="timestamp_cell", msg="Timestamp")
+            nb = self._load_nb(student_notebook_file)
+            self.add_text_to_cell(nb, self.timestamp, cell_id="timestamp_cell", msg="Timestamp")
+            # only the timestamp cell changed, so the schema walk is not
+            # worth it on every submission; keep it for debugging
+            nb_data = self._save_nb(
+                nb, student_notebook_file,
+                validate=self.log.isEnabledFor(logging.DEBUG))
 
             self.log.info("Copying course_dir into .temp")
             user_home_dir = os.path.abspath(os.path.join(os.path.dirname(self.src_path), '.'))
             temp_path = os.path.join(user_home_dir, ".temp", self.coursedir.assignment_id)
-            self.copy_and_overwrite_dir(self.src_path, temp_path)
+            # the notebook itself is written there with its hashcode below
+            self.copy_and_overwrite_dir(
+                self.src_path, temp_path,
+                skip=[os.path.basename(student_notebook_file)])
 
-            # Compute stamped original notebook
-            hashcode = compute_hashcode(student_notebook_file, method='sha1')
+            # Compute stamped original notebook, from the bytes just written
+            hashcode = hashlib.sha1(nb_data).hexdigest()
             cutsize = 20
             hashcode = hashcode[:cutsize]
             hashcode = list(hashcode)
@@ -216,8 +277,8 @@ class ExchangeSubmit(Exchange):
             self.log.info("Hashcode generated: {}".format(hashcode))
 
             # Generate file mwasil2s_info.txt
-            with open(os.path.join(self.src_path, "{}_info.txt".format(get_username())), "w") as fh:
-                fh.write("Username: {}\n".format(get_username()))
+            with open(os.path.join(self.src_path, "{}_info.txt".format(self._username)), "w") as fh:
+                fh.write("Username: {}\n".format(self._username))
                 fh.write("Hashcode: {}\n".format(hashcode))
                 fh.write("Timestamp: {}\n".format(self.timestamp))
             
@@ -225,22 +286,25 @@ class ExchangeSubmit(Exchange):
             self.log.info("Writing hashcode to .temp version")
             hashcoded_notebook_file = os.path.join(temp_path, self.coursedir.assignment_id+".ipynb")
             temp_html_file = os.path.join(temp_path, self.coursedir.assignment_id+".html")
-            self.add_text_to_cell(hashcoded_notebook_file, hashcode, cell_id="hashcode_cell", msg="Ihr Hashcode")
-            
-            # generate html inside the original nbgrader directory     
-            self.log.info("Generating html and copy html to student course dir")  
-            self.generate_html(hashcoded_notebook_file, temp_html_file)
-            # Copy html file to course_dir
+            self.add_text_to_cell(nb, hashcode, cell_id="hashcode_cell", msg="Ihr Hashcode")
+
+            # generate html inside the original nbgrader directory; saving
+            # and converting the hashcoded notebook run in the background
+            # while the submission is copied to the exchange
+            self.log.info("Generating html and copy html to student course dir")
             # Differentiate between the nb file name and the html version with hashcode to avoid conflict when generating feedback
             html_suffix_file = "hashcode"
             student_html_file = os.path.join(self.src_path, self.coursedir.assignment_id+"_{}.html".format(html_suffix_file))
-            # check html file exists, otherwise still submit the assignment
-            self.log.info("Copying html from .temp directory to student course dir")  
-            if self.copy_and_overwrite_file(temp_html_file, student_html_file):
-                self.log.info("There is no html file in user temp, it may fail to generate one")
-            else:
-                self.log.info("Html version is copied to assignment directory")
+            # the html of an earlier submission has its old hashcode, so it
+            # must neither be submitted nor picked up if this one fails
+            for html_file in (temp_html_file, student_html_file):
+                if os.path.exists(html_file):
+                    os.remove(html_file)
+            html_executor = ThreadPoolExecutor(max_workers=1)
+            html_future = html_executor.submit(
+                self._save_hashcoded, nb, hashcoded_notebook_file, temp_html_file)
         else:
+            html_executor = html_future = None
             self.log.warning("Nbgrader cannot generate hashcode, the assignment is not set up for exam.")
             self.log.warning("The notebook name and assignment_id should be the same for exam mode")  
 
@@ -252,27 +316,43 @@ class ExchangeSubmit(Exchange):
         self.log.info("Destination: {}".format(dest_path))
 
         # copy to the real location
-        self.check_filename_diff()
-        self.do_copy(self.src_path, dest_path)
-        with open(os.path.join(dest_path, "timestamp.txt"), "w") as fh:
-            fh.write(self.timestamp)
+        try:
+            self.check_filename_diff()
+            self.do_copy(self.src_path, dest_path)
+            if html_future is not None:
+                try:
+                    html_future.result()
+                except Exception as e:
+                    self.log.error("Failed to generate the html version: {}".format(e))
+                # check html file exists, otherwise still submit the assignment
+                self.log.info("Copying html from .temp directory to student course dir")
+                if self.copy_and_overwrite_file(temp_html_file, student_html_file):
+                    self.log.info("Html version is copied to assignment directory")
+                    # the copy above ran before the html was ready
+                    self.do_copy_file(student_html_file, os.path.join(
+                        dest_path, os.path.basename(student_html_file)))
+                else:
+                    self.log.info("There is no html file in user temp, it may fail to generate one")
+        finally:
+            if html_executor is not None:
+                html_executor.shutdown()
+        self._write_timestamp(os.path.join(dest_path, "timestamp.txt"))
         self.set_perms(
             dest_path,
             fileperms=(S_IRUSR | S_IWUSR | S_IRGRP | S_IROTH),
             dirperms=(S_IRUSR | S_IWUSR | S_IXUSR | S_IRGRP | S_IXGRP))
 
-        # Make this 0777=ugo=rwx so the instructor can delete later. Hidden from other users by the timestamp.
-        #os.chmod(
-        #    dest_path,
-        #    S_IRUSR|S_IWUSR|S_IXUSR|S_IRGRP|S_IWGRP|S_IXGRP|S_IROTH|S_IWOTH|S_IXOTH
-        #)
-
         # also copy to the cache
         if not os.path.isdir(self.cache_path):
             os.makedirs(self.cache_path)
-        self.do_copy(self.src_path, cache_path)
-        with open(os.path.join(cache_path, "timestamp.txt"), "w") as fh:
-            fh.write(self.timestamp)
+        if self.cache_use_hardlinks:
+            # timestamp.txt is linked along with the rest of dest_path; it
+            # is the same inode as the submitted one, so it must not be
+            # written again
+            self._link_tree(dest_path, cache_path)
+        else:
+            self.do_copy(self.src_path, cache_path)
+            self._write_timestamp(os.path.join(cache_path, "timestamp.txt"))
 
         self.log.info("Submitted as: {} {} {}".format(
             self.coursedir.course_id, self.coursedir.assignment_id, str(self.timestamp)
@@ -8,6 +8,9 @@ from jinja2 import contextfilter
 from bs4 import BeautifulSoup
 from .. import utils
 
+TEMPLATE_PATH = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..', 'server_extensions', 'formgrader', 'templates'))
+
 class FormExporter(HTMLExporter):
     """
     My custom exporter
@@ -21,13 +24,15 @@ class FormExporter(HTMLExporter):
     @contextfilter
     def to_choicecell(self, context, source):
         cell = context.get('cell', {})
-        metadata = context.get('cell', {}).metadata
+        # most cells are not choice cells, so do not parse their html
+        if not (utils.is_singlechoice(cell) or utils.is_multiplechoice(cell)):
+            return source
         soup = BeautifulSoup(source, 'html.parser')
         if not soup.ul:
             return soup.prettify().replace('\n', '')
         if utils.is_singlechoice(cell):
             my_type = 'radio'
-        elif utils.is_multiplechoice(cell):
+        else:
             my_type = 'checkbox'
         form = soup.new_tag('form')
         form['class'] = 'hbrs_checkbox'
@@ -71,4 +76,4 @@ class FormExporter(HTMLExporter):
         We want to inherit from HTML template, and have template under
         `./templates/` so append it to the search path. (see next section)
         """
-        return super().template_path + [os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'server_extensions', 'formgrader', 'templates'))]
\ No newline at end of file
+        return super().template_path + [TEMPLATE_PATH]
\ No newline at end of file
@@ -4,7 +4,12 @@ import io
 import os
 from os.path import join
 
+from nbformat.v4 import new_notebook, new_markdown_cell
+import nbformat
+
+from ...utils import get_username
 from .. import run_nbgrader
+from ...exchange import ExchangeFetchAssignment
 from .base import BaseTestApp
 from .conftest import notwindows
 
@@ -20,7 +25,7 @@ class TestNbGraderFetch(BaseTestApp):
             "--Exchange.root={}".format(exchange)
         ])
 
-    def _fetch(self, assignment, exchange, flags=None, retcode=0, course="abc101"):
+    def _fetch(self, assignment, exchange, flags=None, retcode=0, course="abc101", env=None):
         cmd = [
             "fetch_assignment", assignment,
             "--course", course,
@@ -30,7 +35,7 @@ class TestNbGraderFetch(BaseTestApp):
         if flags is not None:
             cmd.extend(flags)
 
-        run_nbgrader(cmd, retcode=retcode)
+        run_nbgrader(cmd, retcode=retcode, env=env)
 
     def _fetch_multi(self, assignments, exchange, flags=None, retcode=0, course="abc101"):
         cmd = [
@@ -113,3 +118,73 @@ class TestNbGraderFetch(BaseTestApp):
         self._fetch_multi(["ps1", "ps2"], exchange, course="abc101", flags=["--Exchange.path_includes_course=True"])
         assert os.path.isfile(join("abc101", "ps1", "p1.ipynb"))
         assert os.path.isfile(join("abc101", "ps2", "p1.ipynb"))
+
+    def test_fetch_scrambled(self, exchange, course_dir):
+        nb = new_notebook(cells=[
+            new_markdown_cell("%% scramble\n#set names = foo || bar\n#random X in names\n#replace NAME X"),
+            new_markdown_cell("Hello {{NAME}}")
+        ])
+        os.makedirs(join(course_dir, "release", "ps1"))
+        nbformat.write(nb, join(course_dir, "release", "ps1", "p1.ipynb"))
+        self._copy_file(join("files", "test.ipynb"), join(course_dir, "release", "ps1", "p2.ipynb"))
+        run_nbgrader([
+            "release_assignment", "ps1",
+            "--course", "abc101",
+            "--Exchange.root={}".format(exchange)
+        ])
+        with io.open(join(course_dir, "release", "ps1", "p2.ipynb"), mode="r", encoding='utf-8') as fh:
+            contents1 = fh.read()
+
+        env = os.environ.copy()
+        env["JUPYTERHUB_USER"] = "foo"
+        self._fetch("ps1", exchange, env=env)
+        nb = nbformat.read(join("ps1", "p1.ipynb"), as_version=4)
+        assert len(nb.cells) == 1
+        assert nb.cells[0].source in ("Hello foo", "Hello bar")
+        assert "scramble_config" in nb.metadata
+        # notebooks which are not scrambled are left untouched
+        with io.open(join("ps1", "p2.ipynb"), mode="r", encoding='utf-8') as fh:
+            contents2 = fh.read()
+        assert contents1 == contents2
+
+    def test_fetch_scrambled_without_jupyterhub(self, exchange, course_dir):
+        nb = new_notebook(cells=[
+            new_markdown_cell("%% scramble\n#set names = foo || bar\n#random X in names\n#replace NAME X"),
+            new_markdown_cell("Hello {{NAME}}")
+        ])
+        os.makedirs(join(course_dir, "release", "ps1"))
+        nbformat.write(nb, join(course_dir, "release", "ps1", "p1.ipynb"))
+        run_nbgrader([
+            "release_assignment", "ps1",
+            "--course", "abc101",
+            "--Exchange.root={}".format(exchange)
+        ])
+
+        # the variant is then chosen by the os user name
+        env = os.environ.copy()
+        env.pop("JUPYTERHUB_USER", None)
+        self._fetch("ps1", exchange, env=env)
+        nb = nbformat.read(join("ps1", "p1.ipynb"), as_version=4)
+        seed = ExchangeFetchAssignment().scramble_seed(get_username())
+        assert nb.metadata.scramble_config.seed == seed
+
+    def test_fetch_scrambled_large_attachment(self, exchange, course_dir):
+        # the attachments of the scramble cell are written before its source
+        cell = new_markdown_cell("%% scramble\n#set names = foo || bar\n#random X in names\n#replace NAME X")
+        cell.attachments = {"image.png": {"image/png": "A" * 100000}}
+        nb = new_notebook(cells=[cell, new_markdown_cell("Hello {{NAME}}")])
+        os.makedirs(join(course_dir, "release", "ps1"))
+        nbformat.write(nb, join(course_dir, "release", "ps1", "p1.ipynb"))
+        run_nbgrader([
+            "release_assignment", "ps1",
+            "--course", "abc101",
+            "--Exchange.root={}".format(exchange)
+        ])
+        self._fetch("ps1", exchange)
+        nb = nbformat.read(join("ps1", "p1.ipynb"), as_version=4)
+        assert "scramble_config" in nb.metadata
+        assert all("%% scramble" not in cell.source for cell in nb.cells)
+
+    def test_scramble_seed(self):
+        # the seed must not depend on the (randomized) builtin string hash
+        assert ExchangeFetchAssignment().scramble_seed("foo") == 10360248816761054764
@@ -1,8 +1,10 @@
 import os
 import sys
+import json
 from os.path import join, exists, isfile
 
 from ...utils import remove, notebook_hash
+from ...exchange import ExchangeFetchFeedback
 from .. import run_nbgrader
 from .base import BaseTestApp
 from .conftest import notwindows
@@ -91,3 +93,32 @@ class TestNbGraderFetchFeedback(BaseTestApp):
         assert os.path.isdir(join("ps1", "feedback", timestamp))
         assert os.path.isfile(join("ps1", "feedback", timestamp, 'p1.html'))
         assert os.path.isfile(join("ps1", "feedback", timestamp, 'p1.html'))
+
+    @notwindows
+    def test_notebook_hash_cache(self, cache):
+        self._copy_file(join("files", "test.ipynb"), "p1.ipynb")
+        exchange = ExchangeFetchFeedback(cache=cache)
+        nb_hash = exchange._notebook_hash("p1.ipynb", "foo")
+        assert nb_hash == notebook_hash("p1.ipynb", "foo")
+        assert exchange._notebook_hash("p1.ipynb") == notebook_hash("p1.ipynb")
+        exchange._save_checksums()
+        assert isfile(join(cache, "checksums.json"))
+
+        # a new run reuses the saved hashes, until the notebook changes
+        exchange = ExchangeFetchFeedback(cache=cache)
+        assert exchange._notebook_hash("p1.ipynb", "foo") == nb_hash
+        assert not exchange._checksums_dirty
+        with open("p1.ipynb", "a") as fh:
+            fh.write("\n")
+        assert exchange._notebook_hash("p1.ipynb", "foo") == notebook_hash("p1.ipynb", "foo")
+        assert exchange._checksums_dirty
+
+        # notebooks which are gone are dropped when saving
+        exchange._save_checksums()
+        os.remove("p1.ipynb")
+        exchange = ExchangeFetchFeedback(cache=cache)
+        self._copy_file(join("files", "test.ipynb"), "p2.ipynb")
+        exchange._notebook_hash("p2.ipynb")
+        exchange._save_checksums()
+        with open(join(cache, "checksums.json"), "r") as fh:
+            assert list(json.load(fh)) == [os.path.abspath("p2.ipynb")]
@@ -2,10 +2,15 @@ import os
 import datetime
 import time
 import stat
+import nbformat
+import pytest
+
+from traitlets.config import Config
 
 from os.path import join, isfile, exists
 
 from ...utils import parse_utc, get_username
+from ...exchange import ExchangeSubmit
 from .. import run_nbgrader
 from .base import BaseTestApp
 from .conftest import notwindows
@@ -40,6 +45,16 @@ class TestNbGraderSubmit(BaseTestApp):
         self._release(assignment, exchange, cache, course_dir, course=course)
         self._fetch(assignment, exchange, cache, course=course)
 
+    def _release_and_fetch_exam(self, exchange, cache, course_dir):
+        self._copy_file(join("files", "test.ipynb"), join(course_dir, "release", "ps1", "ps1.ipynb"))
+        run_nbgrader([
+            "release_assignment", "ps1",
+            "--course", "abc101",
+            "--Exchange.cache={}".format(cache),
+            "--Exchange.root={}".format(exchange)
+        ])
+        self._fetch("ps1", exchange, cache)
+
     def _submit(self, assignment, exchange, cache, flags=None, retcode=0, course="abc101"):
         cmd = [
             "submit", assignment,
@@ -143,6 +158,16 @@ class TestNbGraderSubmit(BaseTestApp):
         # Check fail on missting notebooks submitted with strict flag
         self._submit("ps1", exchange, cache, flags=['--strict'], retcode=1)
 
+    def test_submit_not_found(self, exchange, cache, course_dir):
+        self._release_and_fetch("ps1", exchange, cache, course_dir)
+        out = run_nbgrader([
+            "submit", "ps2",
+            "--course", "abc101",
+            "--Exchange.cache={}".format(cache),
+            "--Exchange.root={}".format(exchange)
+        ], retcode=1)
+        assert "Did you mean: {}".format(os.path.abspath("ps1")) in out
+
     def test_submit_readonly(self, exchange, cache, course_dir):
         self._release_and_fetch("ps1", exchange, cache, course_dir)
         os.chmod(join("ps1", "p1.ipynb"), stat.S_IRUSR)
@@ -240,3 +265,159 @@ class TestNbGraderSubmit(BaseTestApp):
         filename, = os.listdir(join(exchange, "abc101", "inbound"))
         assert exists(join(exchange, "abc101", "inbound", filename, "small_file"))
         assert not exists(join(exchange, "abc101", "inbound", filename, "large_file"))
+
+    def test_submit_large_file(self, exchange, cache, course_dir):
+        self._release_and_fetch("ps1", exchange, cache, course_dir)
+        contents = "".join(str(i) for i in range(100000))
+        self._make_file(join("ps1", "data.csv"), contents=contents)
+        self._submit("ps1", exchange, cache,
+                     flags=['--ExchangeSubmit.cache_use_hardlinks=False'])
+        filename, = os.listdir(join(exchange, "abc101", "inbound"))
+        with open(join(exchange, "abc101", "inbound", filename, "data.csv"), "r") as fh:
+            assert fh.read() == contents
+        with open(join(cache, "abc101", filename, "data.csv"), "r") as fh:
+            assert fh.read() == contents
+
+    @pytest.mark.skipif(not hasattr(os, "copy_file_range"), reason="no copy_file_range")
+    def test_submit_large_file_copy_fallback(self, exchange, cache, course_dir, monkeypatch):
+        # some filesystems report 0 bytes copied without copying anything
+        calls = []
+        def copy_file_range(*args):
+            calls.append(args)
+            return 0
+        monkeypatch.setattr(os, "copy_file_range", copy_file_range)
+
+        self._release_and_fetch("ps1", exchange, cache, course_dir)
+        contents = "".join(str(i) for i in range(100000))
+        self._make_file(join("ps1", "data.csv"), contents=contents)
+        self._submit("ps1", exchange, cache)
+        assert calls
+        filename, = os.listdir(join(exchange, "abc101", "inbound"))
+        with open(join(exchange, "abc101", "inbound", filename, "data.csv"), "r") as fh:
+            assert fh.read() == contents
+
+    def test_submit_cache_hardlinks(self, exchange, cache, course_dir):
+        self._release_and_fetch("ps1", exchange, cache, course_dir)
+        self._submit("ps1", exchange, cache)
+        filename, = os.listdir(join(exchange, "abc101", "inbound"))
+        inbound = os.stat(join(exchange, "abc101", "inbound", filename, "p1.ipynb"))
+        cached = os.stat(join(cache, "abc101", filename, "p1.ipynb"))
+        assert inbound.st_ino == cached.st_ino
+
+    def test_submit_cache_no_hardlinks(self, exchange, cache, course_dir):
+        self._release_and_fetch("ps1", exchange, cache, course_dir)
+        self._submit("ps1", exchange, cache,
+                     flags=['--ExchangeSubmit.cache_use_hardlinks=False'])
+        filename, = os.listdir(join(exchange, "abc101", "inbound"))
+        inbound = os.stat(join(exchange, "abc101", "inbound", filename, "p1.ipynb"))
+        cached = os.stat(join(cache, "abc101", filename, "p1.ipynb"))
+        assert inbound.st_ino != cached.st_ino
+        assert isfile(join(cache, "abc101", filename, "timestamp.txt"))
+
+    def test_submit_exam_hashcode(self, exchange, cache, course_dir):
+        self._release_and_fetch_exam(exchange, cache, course_dir)
+        self._submit("ps1", exchange, cache)
+
+        filename, = os.listdir(join(exchange, "abc101", "inbound"))
+        submission = join(exchange, "abc101", "inbound", filename)
+        assert isfile(join(submission, "ps1.ipynb"))
+        assert isfile(join(submission, "ps1_hashcode.html"))
+        assert isfile(join(submission, "{}_info.txt".format(get_username())))
+        with open(join(submission, "{}_info.txt".format(get_username())), "r") as fh:
+            hashcode = fh.read().split("Hashcode: ")[1].split("\n")[0]
+        with open(join(submission, "ps1_hashcode.html"), "r") as fh:
+            assert hashcode in fh.read()
+
+        # the submitted notebook is stamped, but only the html has the hashcode
+        nb = nbformat.read(join(submission, "ps1.ipynb"), as_version=4)
+        names = [cell.metadata.get("name") for cell in nb.cells]
+        assert names.count("timestamp_cell") == 1
+        assert "hashcode_cell" not in names
+
+        # submitting again updates the timestamp cell
+        time.sleep(1)
+        self._submit("ps1", exchange, cache)
+        nb = nbformat.read(join("ps1", "ps1.ipynb"), as_version=4)
+        names = [cell.metadata.get("name") for cell in nb.cells]
+        assert names.count("timestamp_cell") == 1
+
+        # and the html of the new submission has its own hashcode
+        filename = sorted(set(os.listdir(join(exchange, "abc101", "inbound"))) - {filename})[0]
+        submission = join(exchange, "abc101", "inbound", filename)
+        with open(join(submission, "{}_info.txt".format(get_username())), "r") as fh:
+            new_hashcode = fh.read().split("Hashcode: ")[1].split("\n")[0]
+        assert new_hashcode != hashcode
+        with open(join(submission, "ps1_hashcode.html"), "r") as fh:
+            assert new_hashcode in fh.read()
+
+    def test_html_exporter_shared(self):
+        nb = nbformat.v4.new_notebook(cells=[
+            nbformat.v4.new_markdown_cell("Hello"),
+            nbformat.v4.new_markdown_cell("* foo\n* bar")])
+        first = ExchangeSubmit()
+        first.generate_html(nb, "ps1.ipynb", "ps1.html")
+        with open("ps1.html", "r") as fh:
+            html = fh.read()
+        assert "Hello" in html
+        # lists outside of choice cells are left as they are
+        assert "<li>foo</li>" in html
+        # later submissions in the same process reuse the compiled templates
+        exporter = first._html_exporter
+        ExchangeSubmit().generate_html(nb, "ps1.ipynb", "ps1.html")
+        assert ExchangeSubmit()._html_exporter is exporter
+
+        # unless their config differs, which then applies to the html
+        other = ExchangeSubmit(config=Config({"FormExporter": {"exclude_markdown": True}}))
+        other.generate_html(nb, "ps1.ipynb", "ps1.html")
+        assert other._html_exporter is not exporter
+        with open("ps1.html", "r") as fh:
+            assert "Hello" not in fh.read()
+
+    def test_submit_exam_markdown_list(self, exchange, cache, course_dir):
+        nb = nbformat.v4.new_notebook(cells=[nbformat.v4.new_markdown_cell("* foo\n* bar")])
+        os.makedirs(join(course_dir, "release", "ps1"))
+        nbformat.write(nb, join(course_dir, "release", "ps1", "ps1.ipynb"))
+        run_nbgrader([
+            "release_assignment", "ps1",
+            "--course", "abc101",
+            "--Exchange.cache={}".format(cache),
+            "--Exchange.root={}".format(exchange)
+        ])
+        self._fetch("ps1", exchange, cache)
+        self._submit("ps1", exchange, cache)
+
+        filename, = os.listdir(join(exchange, "abc101", "inbound"))
+        submission = join(exchange, "abc101", "inbound", filename)
+        with open(join(submission, "ps1_hashcode.html"), "r") as fh:
+            assert "foo" in fh.read()
+
+    def test_submit_exam_html_fails(self, exchange, cache, course_dir, monkeypatch):
+        self._release_and_fetch_exam(exchange, cache, course_dir)
+        self._submit("ps1", exchange, cache)
+        first, = os.listdir(join(exchange, "abc101", "inbound"))
+        assert isfile(join(exchange, "abc101", "inbound", first, "ps1_hashcode.html"))
+
+        def generate_html(*args, **kwargs):
+            raise RuntimeError("conversion failed")
+        monkeypatch.setattr(ExchangeSubmit, "generate_html", generate_html)
+        time.sleep(1)
+        self._submit("ps1", exchange, cache)
+
+        # the assignment is submitted all the same, but without the html of
+        # the first submission, which has the wrong hashcode
+        filename, = set(os.listdir(join(exchange, "abc101", "inbound"))) - {first}
+        submission = join(exchange, "abc101", "inbound", filename)
+        assert isfile(join(submission, "ps1.ipynb"))
+        assert isfile(join(submission, "timestamp.txt"))
+        assert not exists(join(submission, "ps1_hashcode.html"))
+        assert not exists(join("ps1", "ps1_hashcode.html"))
+        assert isfile(join(cache, "abc101", filename, "timestamp.txt"))
+
+    def test_submit_exam_html_ignored(self, exchange, cache, course_dir):
+        self._release_and_fetch_exam(exchange, cache, course_dir)
+        self._submit("ps1", exchange, cache,
+                     flags=['--CourseDirectory.ignore=["*.html"]'])
+
+        filename, = os.listdir(join(exchange, "abc101", "inbound"))
+        assert isfile(join("ps1", "ps1_hashcode.html"))
+        assert not exists(join(exchange, "abc101", "inbound", filename, "ps1_hashcode.html"))
@@ -1,12 +1,15 @@
 # coding: utf-8
 
+import copy
 import os
+import hashlib
 import pytest
 import tempfile
 import shutil
 import zipfile
 
-from nbformat.v4 import new_output
+import nbformat
+from nbformat.v4 import new_output, new_notebook, new_markdown_cell, new_code_cell
 from os.path import join
 from setuptools.archive_util import UnrecognizedFormat
 
@@ -331,6 +334,15 @@ def test_ignore_patterns(temp_cwd):
     assert utils.ignore_patterns(exclude=["foo.*"], include=["*.txt"])(dir, files) == ['foo.txt', 'truc.png']
     assert utils.ignore_patterns(max_file_size=2)(dir, files) == ["long.txt"]
 
+def test_compile_globs():
+    pattern = utils.compile_globs([".ipynb_checkpoints", "*.pyc", "__pycache__"])
+    assert pattern.match(".ipynb_checkpoints")
+    assert pattern.match("foo.pyc")
+    assert pattern.match("__pycache__")
+    assert not pattern.match("foo.py")
+    assert not pattern.match("foo.pyc.txt")
+    assert not utils.compile_globs([]).match("foo")
+
 def test_is_ignored(temp_cwd):
     os.mkdir("foo")
     with open(join("foo", "bar.txt"), "w") as fh:
@@ -376,6 +388,27 @@ def test_find_all_files(temp_cwd):
         join(".", "foo", "bar", "baz.txt")]
 
 
+@notwindows
+def test_find_all_notebooks(temp_cwd):
+    os.makedirs(join("foo", "bar"))
+    os.makedirs(join("foo", ".ipynb_checkpoints"))
+    for filename in ["a.ipynb", "b.txt", join("bar", "c.ipynb"), join(".ipynb_checkpoints", "a-checkpoint.ipynb")]:
+        with open(join("foo", filename), "w") as fh:
+            fh.write("{}")
+    os.symlink("bar", join("foo", "quux"))
+
+    assert utils.find_all_notebooks("foo") == ["a.ipynb", join("bar", "c.ipynb")]
+    assert utils.find_all_notebooks(join("foo", "bar")) == ["c.ipynb"]
+    assert utils.find_all_notebooks("missing") == []
+
+
+def test_compute_hashcode(temp_cwd):
+    with open("foo.txt", "wb") as fh:
+        fh.write(b"x" * 300000)
+    assert utils.compute_hashcode("foo.txt") == hashlib.md5(b"x" * 300000).hexdigest()
+    assert utils.compute_hashcode("foo.txt", method='sha1') == hashlib.sha1(b"x" * 300000).hexdigest()
+
+
 def test_unzip_invalid_ext(temp_cwd):
     with open(join("baz.txt"), "w") as fh:
         pass
@@ -437,3 +470,31 @@ def test_get_username():
     assert utils.get_username() == os.environ["USER"]
     # Can't test get_username's support for JUPYTERHUB_USER, as
     # this would require actually running the tests as 'jovyan'.
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_read_write_notebook(temp_cwd, monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(utils, "orjson", None)
+    elif utils.orjson is None:
+        pytest.skip("orjson is not installed")
+    nb = new_notebook(cells=[new_markdown_cell("foo\nbar"), new_code_cell("1 + 1")])
+    nbformat.write(nb, "foo.ipynb")
+    nb = utils.read_notebook("foo.ipynb")
+    assert nb.cells[0].source == "foo\nbar"
+    nb.cells.append(new_markdown_cell("b\u00e4z"))
+    nb.cells[1].outputs.append(new_output("stream", text="2\n3\n"))
+    nb.cells[1].metadata.trusted = True
+    nb.metadata.orig_nbformat = 3
+    expected = copy.deepcopy(nb)
+    data = utils.write_notebook(nb, "bar.ipynb", validate=True)
+    # the notebook is left as it was
+    assert nb == expected
+    # but written without its transient keys
+    del nb.cells[1].metadata["trusted"]
+    del nb.metadata["orig_nbformat"]
+    assert nbformat.read("bar.ipynb", as_version=4) == nb
+    with open("bar.ipynb", "rb") as fh:
+        assert fh.read() == data
+    # with or without orjson, the file is laid out as nbformat writes it
+    assert data == (nbformat.writes(nb) + "\n").encode("utf-8")
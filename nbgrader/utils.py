@@ -10,6 +10,10 @@ import logging
 import traceback
 import contextlib
 import fnmatch
+import functools
+import re
+import json
+import nbformat
 
 from setuptools.archive_util import unpack_archive
 from setuptools.archive_util import unpack_tarfile
@@ -25,6 +29,13 @@ if sys.platform != 'win32':
 else:
     pwd = None
 
+# orjson is an optional, faster replacement for the json module when reading
+# notebooks
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 def is_extra_cell(cell):
     """Returns True if the cell is a form cell."""
     if 'nbgrader' not in cell.metadata:
@@ -289,6 +300,7 @@ def check_directory(path, read=False, write=False, execute=False):
         return False
 
 
+@functools.lru_cache(maxsize=1)
 def get_osusername():
     """Get the username of the current process."""
     if pwd is None:
@@ -331,6 +343,17 @@ def is_ignored(filename, ignore_globs=None):
     return False
 
 
+def compile_globs(globs):
+    """Compile a list of filename globs into a single regular expression
+    matching the names :func:`fnmatch.fnmatch` matches against any of them.
+    Names must be passed through :func:`os.path.normcase` before matching."""
+    if not globs:
+        # never matches
+        return re.compile(r'(?!)')
+    return re.compile('|'.join(
+        fnmatch.translate(os.path.normcase(glob)) for glob in globs))
+
+
 def ignore_patterns(exclude=None, include=None, max_file_size=None, log=None):
     """
     Function that can be used as :func:`shutils.copytree` ignore parameter.
@@ -361,18 +384,21 @@ def ignore_patterns(exclude=None, include=None, max_file_size=None, log=None):
     If a logger is provided, a warning is logged for files too large
     and a debug message for otherwise ignored files.
     """
+    exclude_re = compile_globs(exclude) if exclude else None
+    include_re = compile_globs(include) if include else None
+
     def ignore_patterns(directory, filelist):
         ignored = []
         for filename in filelist:
             rationale = None
             fullname = os.path.join(directory, filename)
-            if exclude and any(fnmatch.fnmatch(filename, glob) for glob in exclude):
+            if exclude_re and exclude_re.match(os.path.normcase(filename)):
                 if log:
                     log.debug("Ignoring excluded file '{}' (see config option CourseDirectory.ignore)".format(fullname))
                 ignored.append(filename)
             else:
                 if os.path.isfile(fullname):
-                    if include and not any(fnmatch.fnmatch(filename, glob) for glob in include):
+                    if include_re and not include_re.match(os.path.normcase(filename)):
                         if log:
                             log.debug("Ignoring non included file '{}' (see config option CourseDirectory.include)".format(fullname))
                         ignored.append(filename)
@@ -403,12 +429,28 @@ def find_all_files(path, exclude=None):
 
 
 def find_all_notebooks(path):
-    """Return a sorted list of notebooks recursively found rooted at `path`."""
+    """Return a sorted list of notebooks recursively found rooted at `path`,
+    leaving out the `.ipynb_checkpoints` directories."""
     notebooks = list()
     rootpath = os.path.abspath(path)
-    for _file in find_all_files(rootpath):
-        if os.path.splitext(_file)[-1] == '.ipynb':
-            notebooks.append(os.path.relpath(_file, rootpath))
+    # like os.walk, but the file types come from the directory entries, so
+    # no file is stat'ed and the paths are built relative to rootpath
+    to_visit = ['']
+    while to_visit:
+        reldir = to_visit.pop()
+        try:
+            it = os.scandir(os.path.join(rootpath, reldir))
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir():
+                    # the checkpoints are copies of the notebooks, not notebooks
+                    # of the assignment
+                    if not entry.is_symlink() and entry.name != '.ipynb_checkpoints':
+                        to_visit.append(os.path.join(reldir, entry.name))
+                elif os.path.splitext(entry.name)[-1] == '.ipynb':
+                    notebooks.append(os.path.join(reldir, entry.name))
     notebooks.sort()
     return notebooks
 
@@ -423,17 +465,87 @@ def full_split(path):
         return full_split(rest) + (last,)
 
 def compute_hashcode(filename, method='md5'):
-    if method=='md5':
-        hashcode = hashlib.md5()
-    elif method=='sha1':
-        hashcode = hashlib.sha1()
-
+    """Compute the hex digest of the content of filename, using the hashlib
+    algorithm method."""
     with open(filename, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hashcode.update(chunk)
-            
+        if hasattr(hashlib, 'file_digest'):
+            # Python >= 3.11: hashed in C, without the GIL
+            hashcode = hashlib.file_digest(f, method)
+        else:
+            hashcode = hashlib.new(method)
+            for chunk in iter(lambda: f.read(2**18), b""):
+                hashcode.update(chunk)
+
     return hashcode.hexdigest()
 
+def read_notebook(path):
+    """Read the notebook at path as a v4 notebook.
+
+    Unlike :func:`nbformat.read`, the notebook is not validated, and its
+    JSON is parsed with orjson when it is installed.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if orjson is not None:
+        nb = nbformat.from_dict(orjson.loads(data))
+    else:
+        nb = nbformat.from_dict(json.loads(data.decode('utf-8')))
+    if nb.get('nbformat') != 4:
+        return nbformat.reads(data.decode('utf-8'), as_version=4)
+    nbformat.v4.rwbase.rejoin_lines(nb)
+    nbformat.v4.rwbase.strip_transient(nb)
+    return nb
+
+
+def _strip_transient(nb):
+    """Like :func:`nbformat.v4.rwbase.strip_transient`, but return the
+    removed ``(metadata, key, value)`` so that they can be put back."""
+    removed = []
+
+    def pop(metadata, key):
+        if key in metadata:
+            removed.append((metadata, key, metadata.pop(key)))
+
+    for key in ('orig_nbformat', 'orig_nbformat_minor', 'signature'):
+        pop(nb.metadata, key)
+    for cell in nb.cells:
+        pop(cell.metadata, 'trusted')
+    return removed
+
+
+def write_notebook(nb, path, validate=False):
+    """Write the v4 notebook nb to path, byte for byte as
+    :func:`nbformat.write` would. If validate is True, schema errors are
+    logged as :func:`nbformat.write` does.
+
+    Returns the bytes written, so that callers can hash them without
+    reading the file back.
+    """
+    if validate:
+        try:
+            nbformat.validate(nb)
+        except nbformat.ValidationError as e:
+            logging.getLogger('nbgrader').error("Notebook JSON is invalid: %s", e)
+    # rather than deep copying the whole notebook, strip its transient keys
+    # and split its multiline strings in place, and undo both once it is
+    # serialized; the json module is used even when orjson is installed,
+    # as orjson cannot produce the one space indentation of nbformat
+    transient = _strip_transient(nb)
+    nbformat.v4.rwbase.split_lines(nb)
+    try:
+        data = json.dumps(
+            nb, cls=nbformat.v4.nbjson.BytesEncoder, indent=1,
+            sort_keys=True, separators=(',', ': '), ensure_ascii=False)
+    finally:
+        nbformat.v4.rwbase.rejoin_lines(nb)
+        for metadata, key, value in transient:
+            metadata[key] = value
+    data = (data + '\n').encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+
 @contextlib.contextmanager
 def chdir(dirname):
     currdir = os.getcwd()
@@ -103,10 +103,14 @@ setup_args = dict(
         "requests",
         "jsonschema",
         "alembic",
-        "fuzzywuzzy",
+        "rapidfuzz",
         "bs4",
         "pandas"
-    ]
+    ],
+    extras_require={
+        # faster parsing of notebooks in the exchange
+        "orjson": ["orjson"]
+    }
 )
 
 if __name__ == "__main__":